@@ -0,0 +1,246 @@
+import os
+import json
+import glob
+import hashlib
+from datetime import datetime, timezone
+
+import joblib
+
+
+# Версия формата манифеста (меняется только при несовместимых изменениях структуры)
+ARTIFACT_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+CURRENT_POINTER = "CURRENT"
+
+# Схема признаков, на которых обучались модели (порядок важен для CatBoost)
+FEATURE_SCHEMA = {
+    "work_year": "int64",
+    "experience_level": "object",
+    "employment_type": "object",
+    "job_title": "object",
+    "salary_currency": "object",
+    "employee_residence": "object",
+    "remote_ratio": "int64",
+    "company_location": "object",
+    "company_size": "object"
+}
+TARGET = "salary_in_usd"
+
+# Способы хранения: CatBoost - нативный .cbm, остальные (Pipeline sklearn) - joblib со сжатием zlib
+STORAGE_CATBOOST = "catboost_cbm"
+STORAGE_JOBLIB_ZLIB = "joblib_zlib"
+
+
+# Метрики старых моделей из таблицы сравнения в ноутбуке (доли, не проценты).
+# legacy_weight_score - ручные оценки, по которым приложение считало веса до бандлов.
+LEGACY_METRICS = {
+    "Linear Regression": {"r2_test": 0.3388, "mape_test": 0.3868, "legacy_weight_score": 2},
+    "Random Forest": {"r2_test": 0.3648, "mape_test": 0.3541, "legacy_weight_score": 3.5},
+    "CatBoost": {"r2_test": 0.3669, "mape_test": 0.3484, "legacy_weight_score": 4.5}
+}
+
+
+class ArtifactError(Exception):
+    """Ошибка чтения или проверки бандла моделей."""
+
+
+def _file_name(model_name, extension):
+    return f"{model_name.replace(' ', '_')}.{extension}"
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Считает SHA-256 файла потоково, не загружая его целиком в память."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_catboost(model):
+    return type(model).__name__.startswith("CatBoost")
+
+
+def _default_storage(model):
+    return STORAGE_CATBOOST if _is_catboost(model) else STORAGE_JOBLIB_ZLIB
+
+
+def weights_from_metrics(metrics, key="r2_test"):
+    """
+    Нормализует метрику моделей (по умолчанию R2 Test) в веса, сумма = 100%.
+    Отрицательные значения (модель хуже среднего) обрезаются до нуля.
+    """
+    scores = {name: max(m[key], 0) for name, m in metrics.items() if m.get(key) is not None}
+    total = sum(scores.values())
+    if total <= 0:
+        return {name: 100 / len(scores) for name in scores} if scores else {}
+    return {name: (score / total) * 100 for name, score in scores.items()}
+
+
+def save_artifacts(models, metrics, save_path="saved_models", version=None, make_current=True,
+                   reference_stats=None, weight_key="r2_test", weights=None, training_files=None,
+                   feature_means=None):
+    """
+    Сохраняет модели в версионированный бандл saved_models/<version>/ с манифестом.
+
+    models          - {имя модели: обученная модель или Pipeline}
+    metrics         - {имя модели: {"r2_test": ..., "mape_test": ...}}
+    reference_stats - статистики обучающего среза для контроля дрейфа (см. retrain_utils)
+    weight_key      - метрика из metrics, по которой считаются веса ансамбля
+    weights         - готовые веса ансамбля (%), если метрики для них непригодны
+    training_files  - CSV-файлы, на которых обучены модели (обучающий срез)
+    feature_means   - {имя модели: средние преобразованных признаков на обучении} для атрибуций
+    """
+    feature_means = feature_means or {}
+    if version is None:
+        version = datetime.now(timezone.utc).strftime("v%Y%m%d%H%M%S")
+    bundle_path = os.path.join(save_path, version)
+    os.makedirs(bundle_path, exist_ok=True)
+
+    if weights is None:
+        weights = weights_from_metrics(metrics, key=weight_key)
+    manifest = {
+        "format_version": ARTIFACT_FORMAT_VERSION,
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "features": FEATURE_SCHEMA,
+        "target": TARGET,
+        "reference_stats": reference_stats,
+        "training_files": training_files,
+        "models": {}
+    }
+
+    for model_name, model in models.items():
+        storage = _default_storage(model)
+        if storage == STORAGE_CATBOOST:
+            file_name = _file_name(model_name, "cbm")
+            model.save_model(os.path.join(bundle_path, file_name), format="cbm")
+        else:
+            file_name = _file_name(model_name, "joblib.z")
+            joblib.dump(model, os.path.join(bundle_path, file_name), compress=("zlib", 3))
+
+        manifest["models"][model_name] = {
+            "file": file_name,
+            "storage": storage,
+            "sha256": file_sha256(os.path.join(bundle_path, file_name)),
+            "metrics": metrics.get(model_name, {}),
+            "weight": weights.get(model_name, 0)
+        }
+        if model_name in feature_means:
+            manifest["models"][model_name]["feature_means"] = feature_means[model_name]
+        if storage == STORAGE_CATBOOST:
+            # .cbm не хранит гиперпараметры обучения - нужны для дообучения
+            manifest["models"][model_name]["params"] = model.get_params()
+
+    with open(os.path.join(bundle_path, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    if make_current:
+        set_current_version(version, save_path)
+    return manifest
+
+
+def set_current_version(version, save_path="saved_models"):
+    """Атомарно переключает активную версию бандла."""
+    tmp_path = os.path.join(save_path, CURRENT_POINTER + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(save_path, CURRENT_POINTER))
+
+
+def get_current_version(save_path="saved_models"):
+    """Возвращает имя активной версии или None, если бандлов ещё нет."""
+    pointer = os.path.join(save_path, CURRENT_POINTER)
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer, encoding="utf-8") as f:
+        return f.read().strip() or None
+
+
+def read_manifest(save_path="saved_models", version=None):
+    """Читает манифест активной (или указанной) версии. None - если бандла нет."""
+    version = version or get_current_version(save_path)
+    if version is None:
+        return None
+    manifest_path = os.path.join(save_path, version, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        raise ArtifactError(f"Манифест не найден: {manifest_path}")
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != ARTIFACT_FORMAT_VERSION:
+        raise ArtifactError(
+            f"Неподдерживаемая версия формата {manifest.get('format_version')} "
+            f"(ожидается {ARTIFACT_FORMAT_VERSION})"
+        )
+    return manifest
+
+
+def load_artifact(entry, bundle_path, verify=True):
+    """Загружает одну модель по записи манифеста, проверяя контрольную сумму."""
+    path = os.path.join(bundle_path, entry["file"])
+    if verify and file_sha256(path) != entry["sha256"]:
+        raise ArtifactError(f"Контрольная сумма не совпадает: {path}")
+
+    storage = entry["storage"]
+    if storage == STORAGE_CATBOOST:
+        from catboost import CatBoostRegressor
+        model = CatBoostRegressor(**entry.get("params", {}))
+        model.load_model(path, format="cbm")
+        return model
+    if storage == STORAGE_JOBLIB_ZLIB:
+        return joblib.load(path)
+    raise ArtifactError(f"Неизвестный способ хранения: {storage}")
+
+
+def load_bundle(save_path="saved_models", version=None, verify=True):
+    """
+    Загружает все модели из манифеста.
+    Возвращает (models, manifest); manifest = None для старых .pkl без манифеста.
+    """
+    manifest = read_manifest(save_path, version)
+    if manifest is None:
+        return load_legacy_models(save_path), None
+
+    bundle_path = os.path.join(save_path, manifest["version"])
+    models = {
+        model_name: load_artifact(entry, bundle_path, verify=verify)
+        for model_name, entry in manifest["models"].items()
+    }
+    return models, manifest
+
+
+def load_legacy_models(save_path="saved_models"):
+    """Находит старые joblib-пиклы (<Имя_Модели>.pkl) без жёстко заданного списка файлов."""
+    models = {}
+    for path in sorted(glob.glob(os.path.join(save_path, "*.pkl"))):
+        model_name = os.path.splitext(os.path.basename(path))[0].replace("_", " ")
+        models[model_name] = joblib.load(path)
+    return models
+
+
+def convert_legacy_models(metrics=LEGACY_METRICS, save_path="saved_models", version=None, feature_means=None):
+    """
+    Переупаковывает старые .pkl в версионированный бандл с манифестом.
+    Веса берутся из legacy_weight_score, чтобы ансамбль не изменился после конвертации.
+    """
+    models = load_legacy_models(save_path)
+    if not models:
+        raise ArtifactError(f"В папке {save_path} нет .pkl моделей для конвертации")
+    metrics = {name: metrics.get(name, {}) for name in models}
+    return save_artifacts(models, metrics, save_path=save_path, version=version,
+                          weight_key="legacy_weight_score", feature_means=feature_means)
+
+
+if __name__ == "__main__":
+    # python -m functions.artifact_utils - конвертация старых .pkl в бандл
+    from functions.explain_utils import linear_feature_means
+    from functions.plotly_utils import build_dataset
+
+    train_df = build_dataset()
+    feature_means = {}
+    for model_name, model in load_legacy_models().items():
+        means = linear_feature_means(model, train_df)
+        if means is not None:
+            feature_means[model_name] = means
+    converted = convert_legacy_models(feature_means=feature_means)
+    print(f"Создан бандл {converted['version']}: {', '.join(converted['models'])}")
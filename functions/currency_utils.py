@@ -0,0 +1,73 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+# Локальная таблица курсов: сколько единиц валюты за 1 USD в каждом году.
+# Курсы восстановлены из самих датасетов (медиана salary / salary_in_usd по году и валюте).
+RATES_PATH = "datasets/exchange_rates.csv"
+
+# Допустимое относительное расхождение salary_in_usd с пересчётом по таблице
+USD_TOLERANCE = 0.05
+
+
+@lru_cache(maxsize=None)
+def load_rate_table(path=RATES_PATH):
+    """
+    Загружает таблицу курсов в матрицу год x валюта.
+    Пропущенные годы заполняются ближайшим известным курсом той же валюты.
+    """
+    rates = pd.read_csv(path).pivot(index="work_year", columns="currency", values="rate_per_usd")
+    years = range(rates.index.min(), rates.index.max() + 1)
+    rates = rates.reindex(years).ffill().bfill()
+    rates["USD"] = 1.0
+    return rates
+
+
+def get_rates(currencies, years, rates=None):
+    """
+    Курсы для целых колонок валют и лет одной векторной выборкой; NaN - неизвестная валюта.
+    currencies и years транслируются друг на друга (numpy broadcasting).
+    """
+    rates = load_rate_table() if rates is None else rates
+    currencies, years = np.broadcast_arrays(np.asarray(currencies, dtype=object), np.asarray(years))
+
+    row = np.clip(years.astype(int), rates.index.min(), rates.index.max()) - rates.index.min()
+    col = rates.columns.get_indexer(currencies.ravel()).reshape(currencies.shape)
+    values = rates.to_numpy()[row, np.where(col >= 0, col, 0)]
+    return np.where(col >= 0, values, np.nan)
+
+
+def convert_to_usd(amounts, currencies, years, rates=None):
+    """Пересчитывает суммы в USD (поэлементно для колонок или скаляров)."""
+    return np.asarray(amounts, dtype=float) / get_rates(currencies, years, rates)
+
+
+def convert_from_usd(amounts_usd, currencies, years, rates=None):
+    """Пересчитывает суммы из USD в указанные валюты."""
+    amounts_usd = np.asarray(amounts_usd, dtype=float)
+    currencies = np.broadcast_to(np.asarray(currencies, dtype=object), amounts_usd.shape)
+    return amounts_usd * get_rates(currencies, years, rates)
+
+
+def salary_in_usd_mismatch(df, tolerance=USD_TOLERANCE, rates=None):
+    """Маска строк, где salary_in_usd расходится с пересчётом salary по таблице курсов."""
+    expected = convert_to_usd(df["salary"], df["salary_currency"], df["work_year"], rates)
+    relative_error = np.abs(df["salary_in_usd"].to_numpy(dtype=float) - expected) / expected
+    return pd.Series(relative_error > tolerance, index=df.index)
+
+
+def normalize_salary_currency(df, rates=None):
+    """
+    Заполняет пропуски salary_in_usd пересчётом salary по таблице курсов.
+    Значения из источника не перезаписываются, расхождения проверяются salary_in_usd_mismatch.
+    """
+    missing = df["salary_in_usd"].isna()
+    if missing.any():
+        df = df.copy()
+        df.loc[missing, "salary_in_usd"] = convert_to_usd(
+            df.loc[missing, "salary"], df.loc[missing, "salary_currency"],
+            df.loc[missing, "work_year"], rates
+        ).round()
+    return df
@@ -0,0 +1,182 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from functions.artifact_utils import FEATURE_SCHEMA
+
+
+BASE_VALUE = "base_value"
+FEATURES = list(FEATURE_SCHEMA)
+
+# Сколько строк (модель x версия x вход) хранится в кэше атрибуций
+CACHE_SIZE = 4096
+
+
+# === Атрибуции по типам моделей ===
+def _catboost_attributions(model, X):
+    """Нативные SHAP-значения CatBoost; последний столбец - ожидаемое значение."""
+    from catboost import Pool
+    pool = Pool(X, cat_features=model.get_cat_feature_indices())
+    shap = model.get_feature_importance(pool, type="ShapValues")
+    return pd.DataFrame(shap, index=X.index, columns=list(X.columns) + [BASE_VALUE])
+
+
+def _transformed_features(preprocessor):
+    """Исходные признаки в порядке выхода ColumnTransformer (все преобразования 1:1)."""
+    features = []
+    for _, transformer, cols in preprocessor.transformers_:
+        if transformer != "drop":
+            features.extend(cols)
+    return features
+
+
+def _tree_path_matrix(tree, n_features):
+    """
+    Матрица узел x признак: изменение предсказания при переходе в узел,
+    отнесённое к признаку родительского сплита (метод Саабаса).
+    """
+    n_nodes = tree.node_count
+    values = tree.value[:, 0, 0]
+    parent = np.full(n_nodes, -1)
+    for children in (tree.children_left, tree.children_right):
+        has_child = children >= 0
+        parent[children[has_child]] = np.flatnonzero(has_child)
+
+    nodes = np.flatnonzero(parent >= 0)
+    return sparse.csr_matrix(
+        (values[nodes] - values[parent[nodes]], (nodes, tree.feature[parent[nodes]])),
+        shape=(n_nodes, n_features)
+    ), values[0]
+
+
+def _forest_attributions(pipeline, X):
+    """Атрибуции по путям в деревьях леса, усреднённые по всем деревьям."""
+    preprocessor, forest = pipeline.named_steps["preprocessor"], pipeline.named_steps["model"]
+    features = _transformed_features(preprocessor)
+    Xt = np.asarray(preprocessor.transform(X), dtype=np.float32)
+
+    contributions = np.zeros((len(X), len(features)))
+    base_value = 0.0
+    for estimator in forest.estimators_:
+        path_matrix, root_value = _tree_path_matrix(estimator.tree_, len(features))
+        contributions += (estimator.decision_path(Xt) @ path_matrix).toarray()
+        base_value += root_value
+    n_trees = len(forest.estimators_)
+
+    result = pd.DataFrame(contributions / n_trees, index=X.index, columns=features)
+    result[BASE_VALUE] = base_value / n_trees
+    return result[list(X.columns) + [BASE_VALUE]]
+
+
+def _linear_attributions(pipeline, X, feature_means=None):
+    """
+    Точный SHAP линейной модели: coef_j * (x_j - mean_j), базовое значение -
+    intercept + coef . mean, где mean - средние преобразованных признаков на обучении.
+    Без сохранённых средних (старые бандлы) - вклады относительно нуля, базовое значение - intercept.
+    """
+    preprocessor, model = pipeline.named_steps["preprocessor"], pipeline.named_steps["model"]
+    features = _transformed_features(preprocessor)
+    Xt = np.asarray(preprocessor.transform(X), dtype=float)
+    coef = np.ravel(model.coef_)
+    means = np.zeros(len(features)) if feature_means is None else np.array([feature_means[f] for f in features])
+
+    result = pd.DataFrame((Xt - means) * coef, index=X.index, columns=features)
+    result[BASE_VALUE] = float(np.ravel(model.intercept_)[0] + coef @ means)
+    return result[list(X.columns) + [BASE_VALUE]]
+
+
+def linear_feature_means(model, X):
+    """
+    Средние преобразованных признаков линейного Pipeline на обучающих строках X -
+    фон для атрибуций. Считаются при сохранении бандла; None - для нелинейных моделей.
+    """
+    if not hasattr(getattr(model, "named_steps", {}).get("model"), "coef_"):
+        return None
+    preprocessor = model.named_steps["preprocessor"]
+    Xt = np.asarray(preprocessor.transform(X[FEATURES]), dtype=float)
+    return dict(zip(_transformed_features(preprocessor), Xt.mean(axis=0).tolist()))
+
+
+def compute_attributions(model, X, feature_means=None):
+    """
+    Атрибуции для пакета строк X. Возвращает DataFrame (признаки + base_value),
+    сумма по строке равна предсказанию модели. None - если тип модели не поддерживается.
+    feature_means - средние признаков на обучении (из манифеста) для линейных моделей.
+    """
+    if type(model).__name__.startswith("CatBoost"):
+        return _catboost_attributions(model, X)
+
+    estimator = getattr(model, "named_steps", {}).get("model")
+    if estimator is None:
+        return None
+    if hasattr(estimator, "estimators_"):
+        return _forest_attributions(model, X)
+    if hasattr(estimator, "coef_"):
+        return _linear_attributions(model, X, feature_means)
+    return None
+
+
+# === Кэш атрибуций по входу и версии модели ===
+# Общий для всех сессий Streamlit (каждая - отдельный поток), поэтому доступ под блокировкой
+_attribution_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _row_keys(X):
+    return [tuple(row) for row in X[FEATURES].itertuples(index=False, name=None)]
+
+
+def explain_batch(models, X, model_version, feature_means=None):
+    """
+    Атрибуции всех моделей для пакета строк с мемоизацией по (версия, модель, вход).
+    Считаются только строки, которых ещё нет в кэше, - одним пакетом на модель.
+    feature_means - {имя модели: средние признаков на обучении} из манифеста версии.
+    Возвращает {имя модели: DataFrame атрибуций}.
+    """
+    feature_means = feature_means or {}
+    X = X[FEATURES]
+    keys = _row_keys(X)
+    explanations = {}
+
+    for model_name, model in models.items():
+        cache_keys = [(model_version, model_name, key) for key in keys]
+
+        # Найденные строки копируются сразу: другой поток может вытеснить их из кэша
+        rows, missing = {}, []
+        with _cache_lock:
+            for i, key in enumerate(cache_keys):
+                if key in _attribution_cache:
+                    _attribution_cache.move_to_end(key)
+                    rows[i] = _attribution_cache[key]
+                else:
+                    missing.append(i)
+
+        if missing:
+            # Расчёт вне блокировки, чтобы не задерживать другие сессии
+            computed = compute_attributions(model, X.iloc[missing], feature_means.get(model_name))
+            if computed is None:
+                continue
+            computed_rows = dict(zip(missing, computed.to_numpy()))
+            rows.update(computed_rows)
+            with _cache_lock:
+                for i, row in computed_rows.items():
+                    _attribution_cache[cache_keys[i]] = row
+                while len(_attribution_cache) > CACHE_SIZE:
+                    _attribution_cache.popitem(last=False)
+
+        explanations[model_name] = pd.DataFrame(
+            [rows[i] for i in range(len(cache_keys))], index=X.index, columns=FEATURES + [BASE_VALUE]
+        )
+    return explanations
+
+
+def ensemble_attributions(explanations, weights):
+    """Атрибуции взвешенного ансамбля: линейная комбинация атрибуций моделей."""
+    w = pd.Series({name: weights.get(name, 0) for name in explanations}, dtype=float)
+    if w.sum() <= 0:
+        w[:] = 1.0
+    w = w / w.sum()
+    return sum(explanations[name] * w[name] for name in explanations)
@@ -1,8 +1,12 @@
 import streamlit as st
-import joblib
-import os
 import pandas as pd
 import numpy as np
+from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import product
+from types import MappingProxyType
+
+from functions.artifact_utils import ArtifactError, load_bundle, read_manifest
 
 
 # МЕТРИКИ ДЛЯ ВЕСОВ (R2 Test из таблицы, нормализованные до 100%)
@@ -17,20 +21,50 @@ total_r2 = sum(r2_test_values.values())
 model_weights = {model: (score / total_r2) * 100 for model, score in r2_test_values.items()}
 
 
-@st.cache_data
-def load_models(save_path="saved_models"):
-    """Загружает три сохраненные модели (каждая - Pipeline)."""
-    models = {}
+@st.cache_resource
+def load_models(save_path="saved_models", version=None):
+    """
+    Загружает модели указанной версии бандла (список моделей берётся из манифеста).
+    version входит в ключ кэша: после переключения CURRENT загружается новая версия.
+    """
     try:
-        models["Linear Regression"] = joblib.load(os.path.join(save_path, "Linear_Regression.pkl"))
-        models["Random Forest"] = joblib.load(os.path.join(save_path, "Random_Forest.pkl"))
-        models["CatBoost"] = joblib.load(os.path.join(save_path, "CatBoost.pkl"))
-    except FileNotFoundError as e:
-        st.error(f"Не удалось найти модели в папке {save_path}: {e}")
+        models, _ = load_bundle(save_path, version)
+    except (FileNotFoundError, ArtifactError) as e:
+        st.error(f"Не удалось загрузить модели из папки {save_path}: {e}")
+        return None
+    if not models:
+        st.error(f"Не удалось найти модели в папке {save_path}")
         return None
     return models
 
 
+@st.cache_data
+def load_model_weights(save_path="saved_models", version=None):
+    """Веса моделей из манифеста версии; для старых .pkl без манифеста - веса по R2 Test выше."""
+    try:
+        manifest = read_manifest(save_path, version)
+    except ArtifactError:
+        manifest = None
+    if manifest is None:
+        return model_weights
+    return {name: entry["weight"] for name, entry in manifest["models"].items()}
+
+
+@st.cache_data
+def load_feature_means(save_path="saved_models", version=None):
+    """Средние признаков на обучении из манифеста версии (фон для атрибуций линейных моделей)."""
+    try:
+        manifest = read_manifest(save_path, version)
+    except ArtifactError:
+        manifest = None
+    if manifest is None:
+        return {}
+    return {
+        name: entry["feature_means"]
+        for name, entry in manifest["models"].items() if "feature_means" in entry
+    }
+
+
 def get_country_data():
     country_data = [
         ("AU", "Австралия"),
@@ -365,4 +399,136 @@ def get_job_title_options():
         "Data Visualization Specialist", "Decision Scientist"
     ])
 
-    return job_title_options
\ No newline at end of file
+    return job_title_options
+
+
+# === Справочники-индексы (строятся один раз на процесс) ===
+@dataclass(frozen=True, eq=False)
+class LookupIndex:
+    """
+    Неизменяемый двусторонний индекс справочника: код <-> название, код/название -> позиция.
+    Общий для интерфейса и пакетного скоринга.
+    """
+    codes: tuple
+    labels: tuple
+    label_by_code: MappingProxyType = field(init=False, repr=False)
+    code_by_label: MappingProxyType = field(init=False, repr=False)
+    position_of_code: MappingProxyType = field(init=False, repr=False)
+    position_of_label: MappingProxyType = field(init=False, repr=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "label_by_code", MappingProxyType(dict(zip(self.codes, self.labels))))
+        object.__setattr__(self, "code_by_label", MappingProxyType(dict(zip(self.labels, self.codes))))
+        object.__setattr__(self, "position_of_code", MappingProxyType({c: i for i, c in enumerate(self.codes)}))
+        object.__setattr__(self, "position_of_label", MappingProxyType({label: i for i, label in enumerate(self.labels)}))
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(tuple(data.keys()), tuple(data.values()))
+
+    @classmethod
+    def from_options(cls, options):
+        """Справочник, где код и название совпадают (например, должности)."""
+        return cls(tuple(options), tuple(options))
+
+    def encode(self, values):
+        """Позиции кодов для целой колонки; -1 для неизвестных значений."""
+        return pd.Categorical(values, categories=self.codes).codes
+
+    def is_valid(self, values):
+        """Булева маска допустимых кодов для целой колонки."""
+        return self.encode(values) >= 0
+
+    def to_labels(self, values):
+        """Коды -> названия (неизвестные коды -> NaN)."""
+        return pd.Series(values).map(self.label_by_code)
+
+    def to_codes(self, labels):
+        """Названия -> коды (неизвестные названия -> NaN)."""
+        return pd.Series(labels).map(self.code_by_label)
+
+
+@lru_cache(maxsize=None)
+def get_lookup_indexes():
+    """Индексы справочников по именам признаков модели."""
+    country_index = LookupIndex.from_dict(get_country_data())
+    return MappingProxyType({
+        "experience_level": LookupIndex.from_dict(get_experience_level_data()),
+        "employment_type": LookupIndex.from_dict(get_employment_type_data()),
+        "job_title": LookupIndex.from_options(get_job_title_options()),
+        "salary_currency": LookupIndex.from_dict(get_salary_currency_data()),
+        "employee_residence": country_index,
+        "company_location": country_index,
+        "company_size": LookupIndex.from_dict(get_company_size_data())
+    })
+
+
+def validate_input(df):
+    """
+    Проверяет категориальные колонки входного DataFrame по справочникам.
+    Возвращает булев DataFrame (True - значение недопустимо) по проверенным колонкам.
+    """
+    indexes = get_lookup_indexes()
+    columns = [col for col in indexes if col in df.columns]
+    return pd.DataFrame(
+        {col: ~indexes[col].is_valid(df[col]) for col in columns},
+        index=df.index
+    )
+
+
+# === Анализ чувствительности (sweep) ===
+WORK_YEAR_OPTIONS = [2020, 2021, 2022, 2023, 2024]
+REMOTE_RATIO_OPTIONS = [0, 50, 100]
+
+# Поля, которые можно варьировать, и их подписи в интерфейсе
+SWEEP_FIELD_LABELS = {
+    "experience_level": "Уровень опыта",
+    "remote_ratio": "Удалённо (%)",
+    "work_year": "Год работы",
+    "employment_type": "Тип занятости",
+    "company_size": "Размер компании",
+    "job_title": "Должность",
+    "company_location": "Локация компании"
+}
+
+
+def get_sweep_options(field_name):
+    """Все допустимые значения (коды) поля для перебора."""
+    if field_name == "work_year":
+        return list(WORK_YEAR_OPTIONS)
+    if field_name == "remote_ratio":
+        return list(REMOTE_RATIO_OPTIONS)
+    return list(get_lookup_indexes()[field_name].codes)
+
+
+def build_sweep_grid(base_row, fields):
+    """
+    Сетка входов: base_row (dict признаков) с полями fields, перебранными
+    по всем значениям (декартово произведение для двух полей).
+    """
+    combos = list(product(*(get_sweep_options(f) for f in fields)))
+    grid = pd.DataFrame([base_row] * len(combos))
+    grid[list(fields)] = pd.DataFrame(combos, columns=list(fields))
+    return grid
+
+
+def predict_grid(models, grid, weights):
+    """
+    Скоринг всей сетки: один batched predict на модель.
+    Возвращает (DataFrame с колонкой на модель и "Взвешенное среднее", {модель: ошибка}).
+    """
+    predictions = pd.DataFrame(index=grid.index)
+    errors = {}
+    for model_name, model in models.items():
+        try:
+            predictions[model_name] = model.predict(grid)
+        except Exception as e:
+            errors[model_name] = e
+    if predictions.empty:
+        return predictions, errors
+
+    w = np.array([weights.get(m, 0) for m in predictions.columns], dtype=float)
+    if w.sum() <= 0:
+        w = np.ones_like(w)
+    predictions["Взвешенное среднее"] = predictions.to_numpy() @ (w / w.sum())
+    return predictions, errors
@@ -6,17 +6,36 @@ import plotly.graph_objects as go
 import plotly.figure_factory as ff
 from scipy.stats import gaussian_kde
 
+from functions.currency_utils import normalize_salary_currency, salary_in_usd_mismatch
+from functions.model_utils import validate_input
+
 # --- Загрузка данных ---
-@st.cache_data
-def load_data(remove_duplicates=True):
-    """Загружает и объединяет данные из CSV-файлов."""
-    df1 = pd.read_csv("datasets/ds_salaries.csv")
-    df2 = pd.read_csv("datasets/salaries.csv")
-    df3 = pd.read_csv("datasets/ds_salary_2024.csv")
-    df = pd.concat([df1, df2, df3], axis=0, ignore_index=True)
+DATASET_PATHS = [
+    "datasets/ds_salaries.csv",
+    "datasets/salaries.csv",
+    "datasets/ds_salary_2024.csv"
+]
+
+
+def build_dataset(paths=DATASET_PATHS, remove_duplicates=True, source_column=None):
+    """
+    Читает и объединяет CSV-файлы, убирает редкие должности (без кэша Streamlit).
+    Строки, где salary_in_usd расходится с пересчётом salary по таблице курсов, отбрасываются;
+    их число сохраняется в df.attrs["currency_mismatches"]. Так же отбрасываются строки
+    с категориями не из справочников модели (validate_input) - df.attrs["invalid_codes"].
+    source_column - имя колонки, в которую записывается путь исходного файла строки.
+    """
+    frames = [pd.read_csv(path) for path in paths]
+    columns = list(frames[0].columns)
+    if source_column:
+        frames = [frame.assign(**{source_column: path}) for frame, path in zip(frames, paths)]
+    df = pd.concat(frames, axis=0, ignore_index=True)
+    df = normalize_salary_currency(df)
+    mismatch = salary_in_usd_mismatch(df)
+    df = df[~mismatch]
 
     if remove_duplicates:
-        df = df.drop_duplicates()
+        df = df.drop_duplicates(subset=columns)
 
     job_titles_counts = df["job_title"].value_counts().to_dict()
     total_count = sum(job_titles_counts.values())
@@ -28,9 +47,19 @@ def load_data(remove_duplicates=True):
         lambda x: "Machine Learning Engineer" if x == "ML Engineer" 
         else "Data Scientist" if x == "Data Science" else x
     )
+    invalid = validate_input(df).any(axis=1)
+    df = df[~invalid]
+    df.attrs["currency_mismatches"] = int(mismatch.sum())
+    df.attrs["invalid_codes"] = int(invalid.sum())
     return df
 
 
+@st.cache_data
+def load_data(remove_duplicates=True):
+    """Загружает и объединяет данные из CSV-файлов."""
+    return build_dataset(DATASET_PATHS, remove_duplicates)
+
+
 def plot_salary_distribution(df, show_kde=False):
     """Гистограмма распределения зарплат."""
     st.subheader("Распределение зарплат в долларах США")
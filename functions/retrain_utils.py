@@ -0,0 +1,353 @@
+import os
+import json
+import time
+import shutil
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.metrics import mean_absolute_percentage_error, r2_score
+from sklearn.model_selection import train_test_split
+
+from functions.artifact_utils import FEATURE_SCHEMA, TARGET, file_sha256, load_bundle, read_manifest, save_artifacts
+from functions.explain_utils import linear_feature_means
+from functions.plotly_utils import DATASET_PATHS, build_dataset
+
+
+# Перцентили salary_in_usd по уровню опыта, которые хранятся как эталонное распределение
+REFERENCE_PERCENTILES = np.linspace(0, 1, 101)
+
+# Минимум строк уровня опыта в новых данных, чтобы сравнивать его распределение зарплат
+DRIFT_MIN_LEVEL_ROWS = 50
+
+# Пороги дрейфа:
+#   category_tvd   - TVD частот категорий сверх ожидаемого шума выборки данного размера
+#   salary_ks_alpha - общий уровень значимости KS-тестов распределения зарплат по уровню опыта
+#   salary_ks_min  - минимальная KS-статистика, считающаяся значимым сдвигом
+DEFAULT_THRESHOLDS = {
+    "category_tvd": 0.1,
+    "salary_ks_alpha": 0.01,
+    "salary_ks_min": 0.05
+}
+
+# Сколько деревьев добавляется к предыдущей модели CatBoost при дообучении
+CATBOOST_WARM_ITERATIONS = 100
+
+# Минимум новых строк в отложенной выборке, чтобы по ней считать метрики и веса
+MIN_HOLDOUT_ROWS = 50
+
+# Доля новых строк в отложенной выборке; разбиение только при ceil(доля * n) >= MIN_HOLDOUT_ROWS
+HOLDOUT_SHARE = 0.25
+
+# Принятые батчи новых данных и очередь ещё не использованных в обучении
+INGEST_DIR = "datasets/ingested"
+PENDING_NAME = "pending.json"
+SOURCE_COLUMN = "_source_file"
+
+CAT_COLS = [col for col, dtype in FEATURE_SCHEMA.items() if dtype == "object"]
+
+
+def compute_reference_stats(df):
+    """Статистики среза данных: частоты категорий и перцентили salary_in_usd по уровню опыта."""
+    frequencies = {
+        col: df[col].value_counts(normalize=True).to_dict()
+        for col in CAT_COLS
+    }
+    salary_distribution = {
+        level: {
+            "n": int(len(salary)),
+            "percentiles": np.quantile(salary, REFERENCE_PERCENTILES).tolist()
+        }
+        for level, salary in df.groupby("experience_level")[TARGET]
+    }
+    return {
+        "n_rows": int(len(df)),
+        "frequencies": frequencies,
+        "salary_distribution": salary_distribution
+    }
+
+
+def _total_variation(ref_freq, new_freq, n_new):
+    """
+    Расстояние полной вариации между распределениями категорий за вычетом ожидаемого
+    шума: даже выборка из того же распределения размера n_new даёт TVD > 0.
+    """
+    ref, new = pd.Series(ref_freq, dtype=float).align(pd.Series(new_freq, dtype=float), fill_value=0.0)
+    tvd = 0.5 * np.abs(ref - new).sum()
+    # E|p_hat - p| ~ sqrt(2 p (1 - p) / (pi n)) для каждой категории
+    noise = 0.5 * np.sqrt(2 * ref * (1 - ref) / (np.pi * n_new)).sum()
+    return float(max(tvd - noise, 0.0))
+
+
+def _ks_statistic(ref_percentiles, salary):
+    """KS-статистика выборки salary против эталонной CDF, восстановленной по перцентилям."""
+    x = np.sort(np.asarray(salary, dtype=float))
+    n = len(x)
+    ref_cdf = np.interp(x, ref_percentiles, REFERENCE_PERCENTILES)
+    ecdf_hi = np.arange(1, n + 1) / n
+    ecdf_lo = np.arange(0, n) / n
+    return float(max((ecdf_hi - ref_cdf).max(), (ref_cdf - ecdf_lo).max()))
+
+
+def _ks_critical(n_ref, n_new, alpha):
+    """Критическое значение двухвыборочного KS-теста (асимптотика Колмогорова)."""
+    return float(np.sqrt(-np.log(alpha / 2) / 2) * np.sqrt((n_ref + n_new) / (n_ref * n_new)))
+
+
+def compute_drift(reference_stats, df, thresholds=None):
+    """Сравнивает новый срез данных с обучающим, возвращает метрики дрейфа по колонкам."""
+    thresholds = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    n_new = len(df)
+
+    category_tvd = {
+        col: _total_variation(reference_stats["frequencies"].get(col, {}), df[col].value_counts(normalize=True), n_new)
+        for col in CAT_COLS
+    }
+
+    # По уровням, где в новых данных мало строк, сравнение слишком шумное
+    levels = [(level, salary) for level, salary in df.groupby("experience_level")[TARGET]
+              if len(salary) >= DRIFT_MIN_LEVEL_ROWS]
+    # Поправка Бонферрони: тестов столько, сколько уровней, ложные срабатывания не суммируются
+    alpha = thresholds["salary_ks_alpha"] / max(len(levels), 1)
+
+    salary_ks = {}
+    for level, salary in levels:
+        reference = reference_stats["salary_distribution"].get(level)
+        if reference is None:
+            # Уровень опыта, которого не было в обучающем срезе, считается полным сдвигом
+            salary_ks[level] = {"ks": 1.0, "critical": 0.0}
+            continue
+        salary_ks[level] = {
+            "ks": _ks_statistic(reference["percentiles"], salary),
+            "critical": _ks_critical(reference["n"], len(salary), alpha)
+        }
+
+    return {
+        "n_rows_reference": reference_stats["n_rows"],
+        "n_rows_current": n_new,
+        "category_tvd": category_tvd,
+        "salary_ks": salary_ks
+    }
+
+
+def needs_retrain(drift, thresholds=None):
+    """Возвращает (нужно ли переобучение, список превышенных порогов)."""
+    thresholds = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    reasons = []
+    for col, value in drift["category_tvd"].items():
+        if value > thresholds["category_tvd"]:
+            reasons.append(f"{col}: TVD {value:.3f}")
+    for level, stat in drift["salary_ks"].items():
+        if stat["ks"] > max(stat["critical"], thresholds["salary_ks_min"]):
+            reasons.append(f"{TARGET}[{level}]: KS {stat['ks']:.3f} (критическое {stat['critical']:.3f})")
+    return bool(reasons), reasons
+
+
+def false_retrain_rate(df, sizes=(500, 1000, 2000), trials=40, thresholds=None, random_state=11):
+    """
+    Проверка калибровки: доля случайных подвыборок самого обучающего среза,
+    на которых сработал бы порог дрейфа. Для корректных порогов должна быть близка к нулю.
+    """
+    reference_stats = compute_reference_stats(df)
+    rng = np.random.default_rng(random_state)
+    rates = {}
+    for size in sizes:
+        triggered = 0
+        for _ in range(trials):
+            sample = df.iloc[rng.choice(len(df), size=size, replace=False)]
+            drift = compute_drift(reference_stats, sample, thresholds)
+            triggered += needs_retrain(drift, thresholds)[0]
+        rates[size] = triggered / trials
+    return rates
+
+
+def _refit(model_name, prev_model, X_train, y_train):
+    """Обучает модель на новых данных; CatBoost дообучается поверх предыдущей модели."""
+    if type(prev_model).__name__.startswith("CatBoost"):
+        params = prev_model.get_params()
+        params["iterations"] = CATBOOST_WARM_ITERATIONS
+        params["cat_features"] = CAT_COLS
+        model = type(prev_model)(**params)
+        model.fit(X_train, y_train, init_model=prev_model)
+        return model
+    model = clone(prev_model)
+    model.fit(X_train, y_train)
+    return model
+
+
+def retrain_models(prev_models, train_df, holdout_df):
+    """
+    Переобучает все модели предыдущей версии на train_df, возвращает (models, metrics).
+    Метрики считаются на holdout_df - строках, которых предыдущие модели не видели;
+    если их меньше MIN_HOLDOUT_ROWS, в metrics остаётся только время обучения.
+    """
+    X_train, y_train = train_df[list(FEATURE_SCHEMA)], train_df[TARGET]
+    X_test, y_test = holdout_df[list(FEATURE_SCHEMA)], holdout_df[TARGET]
+    evaluate = len(holdout_df) >= MIN_HOLDOUT_ROWS
+
+    models, metrics = {}, {}
+    for model_name, prev_model in prev_models.items():
+        start = time.perf_counter()
+        model = _refit(model_name, prev_model, X_train, y_train)
+        models[model_name] = model
+        metrics[model_name] = {"fit_seconds": round(time.perf_counter() - start, 2)}
+        if evaluate:
+            y_pred = model.predict(X_test)
+            metrics[model_name]["r2_test"] = float(r2_score(y_test, y_pred))
+            metrics[model_name]["mape_test"] = float(mean_absolute_percentage_error(y_test, y_pred))
+    return models, metrics
+
+
+# === Накопление новых данных ===
+def read_pending(ingest_dir=INGEST_DIR):
+    """Список принятых, но ещё не вошедших в обучение батчей."""
+    pending_path = os.path.join(ingest_dir, PENDING_NAME)
+    if not os.path.exists(pending_path):
+        return []
+    with open(pending_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_pending(pending, ingest_dir=INGEST_DIR):
+    os.makedirs(ingest_dir, exist_ok=True)
+    tmp_path = os.path.join(ingest_dir, PENDING_NAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(pending, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(ingest_dir, PENDING_NAME))
+
+
+def _ingested_hashes(ingest_dir=INGEST_DIR):
+    """Хэши содержимого уже принятых батчей (префикс имени файла в ingest_dir)."""
+    if not os.path.isdir(ingest_dir):
+        return set()
+    return {name.split("_", 1)[0] for name in os.listdir(ingest_dir) if name.endswith(".csv")}
+
+
+def ingest_batches(paths, ingest_dir=INGEST_DIR):
+    """
+    Копирует новые CSV в ingest_dir и добавляет их в очередь ожидания.
+    Имя копии начинается с SHA-256 содержимого: повторно переданный тот же файл
+    (или его копия под другим именем) не принимается второй раз.
+    Батчи хранятся постоянно, поэтому не теряются, если переобучение отложено.
+    """
+    os.makedirs(ingest_dir, exist_ok=True)
+    pending = read_pending(ingest_dir)
+    seen = _ingested_hashes(ingest_dir)
+    for path in paths:
+        # Выгрузка за период может отсутствовать - это не ошибка запуска
+        if not os.path.exists(path):
+            continue
+        digest = file_sha256(path)
+        if digest in seen:
+            continue
+        target = os.path.join(ingest_dir, f"{digest}_{os.path.basename(path)}")
+        shutil.copyfile(path, target)
+        pending.append(target)
+        seen.add(digest)
+    _write_pending(pending, ingest_dir)
+    return pending
+
+
+def calibrate_thresholds(save_path="saved_models", thresholds=None):
+    """Доля ложных переобучений на подвыборках текущего обучающего среза (см. false_retrain_rate)."""
+    manifest = read_manifest(save_path) or {}
+    df = build_dataset(manifest.get("training_files") or list(DATASET_PATHS))
+    return false_retrain_rate(df, thresholds=thresholds)
+
+
+def run_retrain(new_paths=(), save_path="saved_models", ingest_dir=INGEST_DIR, thresholds=None, force=False):
+    """
+    Один запуск планового переобучения.
+
+    Новые батчи (new_paths и ранее отложенные) сравниваются с обучающим срезом из манифеста.
+    Если дрейф ниже порогов - модели не трогаются, батчи остаются в очереди.
+    Иначе модели обучаются на срезе + новых батчах, которые становятся частью среза.
+    """
+    prev_models, manifest = load_bundle(save_path)
+    if not prev_models:
+        raise FileNotFoundError(f"В папке {save_path} нет моделей для переобучения")
+    manifest = manifest or {}
+
+    pending = ingest_batches(new_paths, ingest_dir) if new_paths else read_pending(ingest_dir)
+    training_files = manifest.get("training_files") or list(DATASET_PATHS)
+    if not pending and not force:
+        return {"retrained": False, "drift": None, "reasons": ["нет новых данных"]}
+
+    # build_dataset уже отбрасывает строки, где salary_in_usd не сходится с таблицей курсов,
+    # и строки с категориями не из справочников
+    df = build_dataset(training_files + pending, source_column=SOURCE_COLUMN)
+    currency_mismatches = df.attrs.get("currency_mismatches", 0)
+    invalid_codes = df.attrs.get("invalid_codes", 0)
+    is_new = df[SOURCE_COLUMN].isin(pending)
+
+    # Батчи, от которых после очистки не осталось строк, убираются из очереди:
+    # иначе они ждали бы переобучения вечно
+    usable = set(df.loc[is_new, SOURCE_COLUMN])
+    rejected_batches = [path for path in pending if path not in usable]
+    if rejected_batches:
+        pending = [path for path in pending if path in usable]
+        _write_pending(pending, ingest_dir)
+
+    df = df.drop(columns=SOURCE_COLUMN)
+    new_df = df[is_new]
+
+    reference_stats = manifest.get("reference_stats")
+    if new_df.empty:
+        drift, retrain, reasons = None, False, ["в новых батчах нет пригодных строк"]
+    elif reference_stats is None or "salary_distribution" not in reference_stats:
+        drift, retrain, reasons = None, True, ["нет статистик обучающего среза"]
+    else:
+        drift = compute_drift(reference_stats, new_df, thresholds)
+        retrain, reasons = needs_retrain(drift, thresholds)
+
+    if force and not retrain:
+        retrain, reasons = True, ["принудительный запуск"]
+    if not retrain:
+        return {"retrained": False, "drift": drift, "reasons": reasons, "pending_batches": pending,
+                "rejected_batches": rejected_batches, "currency_mismatches": currency_mismatches,
+                "invalid_codes": invalid_codes}
+
+    # Отложенная выборка - только из новых строк: предыдущие модели (в т.ч. CatBoost,
+    # от которого идёт дообучение) их не видели, поэтому метрики и веса честные.
+    # Если новых строк слишком мало для оценки, все они идут в обучение
+    if np.ceil(HOLDOUT_SHARE * len(new_df)) >= MIN_HOLDOUT_ROWS:
+        new_train, holdout = train_test_split(new_df, test_size=HOLDOUT_SHARE, random_state=11)
+    else:
+        new_train, holdout = new_df, new_df.iloc[:0]
+    train_df = pd.concat([df[~is_new], new_train])
+
+    models, metrics = retrain_models(prev_models, train_df, holdout)
+    weights = None
+    r2_scores = [m.get("r2_test") for m in metrics.values()]
+    if None in r2_scores or max(r2_scores) <= 0:
+        # Новых строк мало для оценки или ни одна модель не лучше среднего -
+        # веса ансамбля остаются прежними
+        weights = {
+            name: manifest.get("models", {}).get(name, {}).get("weight", 100 / len(models))
+            for name in models
+        }
+
+    # Средние признаков обучающего среза - фон для точных атрибуций линейных моделей
+    feature_means = {}
+    for model_name, model in models.items():
+        means = linear_feature_means(model, train_df)
+        if means is not None:
+            feature_means[model_name] = means
+
+    new_manifest = save_artifacts(
+        models, metrics, save_path=save_path, weights=weights,
+        reference_stats=compute_reference_stats(df),
+        training_files=training_files + pending,
+        feature_means=feature_means
+    )
+    _write_pending([], ingest_dir)
+    return {
+        "retrained": True,
+        "drift": drift,
+        "reasons": reasons,
+        "rejected_batches": rejected_batches,
+        "currency_mismatches": currency_mismatches,
+        "invalid_codes": invalid_codes,
+        "version": new_manifest["version"],
+        "metrics": metrics
+    }
@@ -1,10 +1,115 @@
 
 import plotly.express as px
 from functions.model_utils import *
+from functions.artifact_utils import get_current_version
+from functions.currency_utils import convert_from_usd
+from functions.explain_utils import BASE_VALUE, ensemble_attributions, explain_batch
+
+def _sweep_axis_labels(field_name, values):
+    """Подписи значений поля для осей графика (названия вместо кодов)."""
+    indexes = get_lookup_indexes()
+    if field_name in indexes:
+        return indexes[field_name].to_labels(values).fillna(pd.Series(values)).tolist()
+    return list(values)
+
+
+def show_attributions(models, input_data, model_weights, model_version):
+    """Вклад признаков в предсказание: ансамбль и отдельные модели."""
+    try:
+        feature_means = load_feature_means(version=model_version)
+        explanations = explain_batch(models, input_data, model_version or "legacy", feature_means)
+    except Exception as e:
+        st.warning(f"Не удалось рассчитать вклад признаков: {e}")
+        return
+    if not explanations:
+        return
+
+    st.subheader("Вклад признаков в предсказание")
+    ensemble = ensemble_attributions(explanations, model_weights).iloc[0]
+    st.write(f"**Базовое значение ансамбля:** ${ensemble[BASE_VALUE]:,.2f} USD")
+
+    contrib = ensemble.drop(BASE_VALUE).sort_values(key=np.abs)
+    contrib_df = pd.DataFrame({"Признак": contrib.index, "Вклад (USD)": contrib.values})
+    fig = px.bar(
+        contrib_df,
+        x="Вклад (USD)",
+        y="Признак",
+        orientation="h",
+        color="Вклад (USD)",
+        color_continuous_scale="RdBu",
+        color_continuous_midpoint=0,
+        title="Вклад признаков (взвешенный ансамбль)"
+    )
+    fig.update_layout(height=450, coloraxis_showscale=False)
+    st.plotly_chart(fig, use_container_width=True)
+
+    with st.expander("Вклады по моделям"):
+        per_model = pd.DataFrame({name: attr.iloc[0] for name, attr in explanations.items()})
+        st.dataframe(per_model.style.format("{:,.2f}"))
+
+
+def show_sweep(models, input_row, sweep_fields, model_weights):
+    """Кривая отклика (одно поле) или тепловая карта (два поля) по всей сетке значений."""
+    grid = build_sweep_grid(input_row, sweep_fields)
+    predictions, errors = predict_grid(models, grid, model_weights)
+    for model_name, e in errors.items():
+        st.warning(f"Ошибка предсказания для {model_name}: {e}")
+    if predictions.empty:
+        return
+
+    # Пересчёт всей сетки в выбранную валюту одной операцией; год берётся из строки сетки,
+    # поэтому курс верный и тогда, когда work_year - перебираемое поле
+    currency = input_row["salary_currency"]
+    predictions = pd.DataFrame(
+        convert_from_usd(predictions.to_numpy(), currency, grid["work_year"].to_numpy()[:, None]),
+        index=predictions.index,
+        columns=predictions.columns
+    )
+    value_label = f"Предсказание ({currency})"
+
+    st.subheader("Анализ чувствительности")
+    if len(sweep_fields) == 1:
+        field_name = sweep_fields[0]
+        curve_df = predictions.copy()
+        curve_df[field_name] = _sweep_axis_labels(field_name, grid[field_name])
+        curve_df = curve_df.melt(id_vars=field_name, var_name="Модель", value_name=value_label)
+        fig = px.line(
+            curve_df,
+            x=field_name,
+            y=value_label,
+            color="Модель",
+            markers=True,
+            title=f"Зависимость зарплаты: {SWEEP_FIELD_LABELS[field_name]}",
+            labels={field_name: SWEEP_FIELD_LABELS[field_name], value_label: f"Зарплата ({currency})"}
+        )
+    else:
+        row_field, col_field = sweep_fields
+        heatmap = predictions["Взвешенное среднее"].to_numpy().reshape(
+            len(get_sweep_options(row_field)), len(get_sweep_options(col_field))
+        )
+        fig = px.imshow(
+            heatmap,
+            x=_sweep_axis_labels(col_field, get_sweep_options(col_field)),
+            y=_sweep_axis_labels(row_field, get_sweep_options(row_field)),
+            color_continuous_scale="Viridis",
+            aspect="auto",
+            title=f"Взвешенное среднее ({currency})",
+            labels={"x": SWEEP_FIELD_LABELS[col_field], "y": SWEEP_FIELD_LABELS[row_field], "color": f"Зарплата ({currency})"}
+        )
+    fig.update_layout(height=500)
+    st.plotly_chart(fig, use_container_width=True)
+
 
 def main():
     st.title("Предсказание зарплаты (3 модели)")
 
+    # Активная версия читается на каждом запуске: кэши моделей и весов привязаны к ней,
+    # поэтому после ночного переобучения подхватывается новая версия без перезапуска
+    model_version = get_current_version()
+
+    # Веса берутся из манифеста активной версии моделей
+    model_weights = load_model_weights(version=model_version)
+
     # Показываем веса моделей с улучшенным стилем
     st.markdown("### Веса моделей (на основе R² Test, нормализованные до 100%)")
     weights_df = pd.DataFrame({
@@ -14,99 +119,98 @@ def main():
     st.table(weights_df)
 
     # Загружаем модели
-    models = load_models()
+    models = load_models(version=model_version)
     if models is None:
         st.stop()
 
     # === Справочники (упорядоченные списки) ===
-    work_year_options = [2020, 2021, 2022, 2023, 2024]
+    work_year_options = WORK_YEAR_OPTIONS
     
-    job_title_options = get_job_title_options()
-
-    # Создаем словари
-    country_dict = get_country_data()
-    experience_level_dict = get_experience_level_data()
-    employment_type_dict = get_employment_type_data()
-    company_size_dict = get_company_size_data()
-    salary_currency_dict = get_salary_currency_data()
-
-    # Обратные словари: key=русское название, value=код
-    reverse_country_dict = {v: k for k, v in country_dict.items()}
-    reverse_experience_level_dict = {v: k for k, v in experience_level_dict.items()}
-    reverse_employment_type_dict = {v: k for k, v in employment_type_dict.items()}
-    reverse_company_size_dict = {v: k for k, v in company_size_dict.items()}
-    reverse_salary_currency_dict = {v: k for k, v in salary_currency_dict.items()}
+    # Справочники: неизменяемые индексы, построенные один раз на процесс
+    indexes = get_lookup_indexes()
+    country_index = indexes["company_location"]
+    experience_level_index = indexes["experience_level"]
+    employment_type_index = indexes["employment_type"]
+    job_title_index = indexes["job_title"]
+    salary_currency_index = indexes["salary_currency"]
+    company_size_index = indexes["company_size"]
 
     # Боковая панель ввода
     with st.sidebar:
         st.header("Ввод данных для предсказания")
         with st.form("input_form"):
             # Локация компании
-            company_location_code = st.selectbox(
+            company_location_label = st.selectbox(
                 "Локация компании", 
-                list(reverse_country_dict.keys()), 
-                index=list(reverse_country_dict.values()).index("US")  # по умолчанию = "US"
+                country_index.labels, 
+                index=country_index.position_of_code["US"]  # по умолчанию = "US"
             )
-            company_location = reverse_country_dict[company_location_code]
+            company_location = country_index.code_by_label[company_location_label]
 
             # Страна сотрудника
-            employee_residence_code = st.selectbox(
+            employee_residence_label = st.selectbox(
                 "Страна сотрудника", 
-                list(reverse_country_dict.keys()), 
-                index=list(reverse_country_dict.values()).index("US")  # по умолчанию = "US"
+                country_index.labels, 
+                index=country_index.position_of_code["US"]  # по умолчанию = "US"
             )
-            employee_residence = reverse_country_dict[employee_residence_code]
+            employee_residence = country_index.code_by_label[employee_residence_label]
            
             work_year = st.selectbox("Год работы", work_year_options, index=4)  # 2024 по умолчанию
 
-            # Уровень опыта (пример: по умолчанию "Средний")
-            default_experience_label = "Средний"
+            # Уровень опыта (по умолчанию "Средний")
             experience_level_label = st.selectbox(
                 "Уровень опыта", 
-                list(reverse_experience_level_dict.keys()), 
-                index=list(reverse_experience_level_dict.keys()).index(default_experience_label)
+                experience_level_index.labels, 
+                index=experience_level_index.position_of_code["MI"]
             )
             # Получаем код, например "MI"
-            experience_level = reverse_experience_level_dict[experience_level_label]
+            experience_level = experience_level_index.code_by_label[experience_level_label]
 
-            # Тип занятости (пример: по умолчанию "Полная занятость")
-            default_employment_label = "Полная занятость"
+            # Тип занятости (по умолчанию "Полная занятость")
             employment_type_label = st.selectbox(
                 "Тип занятости", 
-                list(reverse_employment_type_dict.keys()), 
-                index=list(reverse_employment_type_dict.keys()).index(default_employment_label)
+                employment_type_index.labels, 
+                index=employment_type_index.position_of_code["FT"]
             )
-            employment_type = reverse_employment_type_dict[employment_type_label]
+            employment_type = employment_type_index.code_by_label[employment_type_label]
 
             # Должность
-            job_title = st.selectbox("Должность", job_title_options, index=job_title_options.index("Data Scientist"))
+            job_title = st.selectbox(
+                "Должность", job_title_index.labels, index=job_title_index.position_of_code["Data Scientist"]
+            )
 
-            # Валюта (пример: по умолчанию "USD")
-            default_currency_label = "Доллар США"
+            # Валюта (по умолчанию "USD")
             salary_currency_label = st.selectbox(
                 "Валюта зарплаты", 
-                list(reverse_salary_currency_dict.keys()), 
-                index=list(reverse_salary_currency_dict.keys()).index(default_currency_label)
+                salary_currency_index.labels, 
+                index=salary_currency_index.position_of_code["USD"]
             )
-            salary_currency = reverse_salary_currency_dict[salary_currency_label]
+            salary_currency = salary_currency_index.code_by_label[salary_currency_label]
 
             # Удалённо %
             remote_ratio = st.slider("Удалённо (%)", 0, 100, 0, 50)
 
-            # Размер компании (пример: по умолчанию "Большая компания")
-            default_company_size_label = "Большая компания"
+            # Размер компании (по умолчанию "Большая компания")
             company_size_label = st.selectbox(
                 "Размер компании", 
-                list(reverse_company_size_dict.keys()), 
-                index=list(reverse_company_size_dict.keys()).index(default_company_size_label)
+                company_size_index.labels, 
+                index=company_size_index.position_of_code["L"]
+            )
+            company_size = company_size_index.code_by_label[company_size_label]
+
+            # Анализ чувствительности: одно или два поля перебираются по всем значениям
+            sweep_fields = st.multiselect(
+                "Варьировать поля (анализ чувствительности)",
+                list(SWEEP_FIELD_LABELS),
+                format_func=SWEEP_FIELD_LABELS.get,
+                max_selections=2
             )
-            company_size = reverse_company_size_dict[company_size_label]
 
             submit = st.form_submit_button("Предсказать")
 
     # Центральная часть: предсказания и визуализация
     if submit:
-        input_data = pd.DataFrame([{
+        input_row = {
             "work_year": work_year,
             "experience_level": experience_level,
             "employment_type": employment_type,
@@ -116,7 +220,8 @@ def main():
             "remote_ratio": remote_ratio,
             "company_location": company_location,
             "company_size": company_size
-        }])
+        }
+        input_data = pd.DataFrame([input_row])
 
         # Предсказания от каждой модели
         predictions = {}
@@ -138,7 +243,16 @@ def main():
             else:
                 sum_w = sum(model_weights[m] for m in valid_models)
                 weighted_sum = sum(predictions[m] * (model_weights[m] / 100) for m in valid_models)
-                weighted_pred = weighted_sum
+                # Перенормировка, если часть моделей из манифеста недоступна
+                weighted_pred = weighted_sum / (sum_w / 100)
+
+            # 3) Пересчёт всех сумм в выбранную валюту одной векторной операцией
+            usd_values = list(predictions.values()) + [avg_pred, weighted_pred]
+            local_values = convert_from_usd(usd_values, salary_currency, work_year)
+            local_text = {
+                key: (f" (≈ {val:,.2f} {salary_currency})" if salary_currency != "USD" else "")
+                for key, val in zip(list(predictions) + ["avg", "weighted"], local_values)
+            }
 
             with st.container():
                 st.subheader("Результаты предсказаний")
@@ -149,20 +263,20 @@ def main():
                     for model_name, val in predictions.items():
                         weight = model_weights.get(model_name, 0)
                         if model_name in ["Random Forest", "CatBoost"]:
-                            st.markdown(f"**{model_name} (вес {weight:.2f}%):** ${val:,.2f} USD", unsafe_allow_html=True)
+                            st.markdown(f"**{model_name} (вес {weight:.2f}%):** ${val:,.2f} USD{local_text[model_name]}", unsafe_allow_html=True)
                         else:
-                            st.write(f"**{model_name} (вес {weight:.2f}%):** ${val:,.2f} USD")
+                            st.write(f"**{model_name} (вес {weight:.2f}%):** ${val:,.2f} USD{local_text[model_name]}")
                 
                 # Средние значения
                 with col2:
-                    st.write(f"**Обычное среднее:** ${avg_pred:,.2f} USD")
-                    st.write(f"**Взвешенное среднее:** ${weighted_pred:,.2f} USD")
+                    st.write(f"**Обычное среднее:** ${avg_pred:,.2f} USD{local_text['avg']}")
+                    st.write(f"**Взвешенное среднее:** ${weighted_pred:,.2f} USD{local_text['weighted']}")
 
                 # Визуализация
                 pred_df = pd.DataFrame({
                     'Модель': list(predictions.keys()),
                     'Предсказание (USD)': list(predictions.values()),
-                    'Вес (%)': [model_weights[m] for m in predictions.keys()]
+                    'Вес (%)': [model_weights.get(m, 0) for m in predictions.keys()]
                 })
                 fig = px.bar(
                     pred_df, 
@@ -186,6 +300,11 @@ def main():
                     """
                 )
 
+            show_attributions(models, input_data, model_weights, model_version)
+
+        if sweep_fields:
+            show_sweep(models, input_row, sweep_fields, model_weights)
+
 
 if __name__ == "__main__":
     main()
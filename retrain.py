@@ -0,0 +1,62 @@
+"""
+Плановое переобучение моделей с контролем дрейфа данных.
+
+Запуск (например, ночью по cron) на батче, который выгрузка кладёт за прошедшие сутки:
+    0 3 * * * cd /path/to/ds_basic_final && python retrain.py datasets/incoming/batch_$(date -d yesterday +\%F).csv
+
+Новые CSV копируются в datasets/ingested/ и сравниваются с обучающим срезом из манифеста.
+Файл с уже принятым содержимым (по SHA-256) повторно не принимается, а батчи без
+пригодных строк после очистки убираются из очереди.
+Если дрейф ниже порогов, модели не переобучаются, а батчи ждут следующего запуска.
+После переобучения батчи становятся частью обучающего среза (training_files в манифесте).
+
+Проверка порогов (подвыборки обучающего среза не должны вызывать переобучение):
+    python retrain.py --calibrate
+"""
+import argparse
+import json
+
+from functions.retrain_utils import DEFAULT_THRESHOLDS, calibrate_thresholds, run_retrain
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Переобучение моделей при дрейфе данных")
+    parser.add_argument("datasets", nargs="*", help="Дополнительные CSV с новыми данными")
+    parser.add_argument("--save-path", default="saved_models", help="Папка с бандлами моделей")
+    parser.add_argument("--category-tvd", type=float, default=DEFAULT_THRESHOLDS["category_tvd"],
+                        help="Порог TVD частот категорий")
+    parser.add_argument("--salary-alpha", type=float, default=DEFAULT_THRESHOLDS["salary_ks_alpha"],
+                        help="Уровень значимости KS-теста распределения зарплат")
+    parser.add_argument("--salary-ks-min", type=float, default=DEFAULT_THRESHOLDS["salary_ks_min"],
+                        help="Минимальная KS-статистика, считающаяся сдвигом")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="Проверить долю ложных переобучений на подвыборках обучающего среза")
+    parser.add_argument("--force", action="store_true", help="Переобучить независимо от дрейфа")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    thresholds = {
+        "category_tvd": args.category_tvd,
+        "salary_ks_alpha": args.salary_alpha,
+        "salary_ks_min": args.salary_ks_min
+    }
+
+    if args.calibrate:
+        rates = calibrate_thresholds(args.save_path, thresholds)
+        for size, rate in rates.items():
+            print(f"Подвыборка {size} строк: переобучение в {rate:.0%} случаев")
+        return
+
+    result = run_retrain(args.datasets, save_path=args.save_path, thresholds=thresholds, force=args.force)
+
+    if result["retrained"]:
+        print(f"Модели переобучены, новая версия: {result['version']}")
+    else:
+        print(f"Переобучение пропущено: {'; '.join(result['reasons']) or 'дрейф ниже порогов'}")
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()